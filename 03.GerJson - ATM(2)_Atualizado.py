@@ -1,11 +1,24 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import logging
-from datetime import datetime, timedelta
+import os
+import queue
+import random
+import threading
+
+try:
+    import orjson
+except ImportError:  # fallback para a stdlib
+    orjson = None
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 from typing import Dict, Optional
 from dataclasses import dataclass
 from time import sleep
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 @dataclass
 class APIConfig:
@@ -15,79 +28,259 @@ class APIConfig:
     per_page: int = 200
     retry_attempts: int = 3
     retry_delay: int = 5
+    max_workers: int = 16
+
+def _retry_after_seconds(value: Optional[str], default: float) -> float:
+    """Interpreta Retry-After tanto em segundos quanto em HTTP-date (RFC 7231)"""
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        wait = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return default
+    return max(wait, 0.0)
+
+def configure_logging():
+    """Configura o logging uma única vez por processo (sem handlers duplicados)"""
+    if logging.getLogger().handlers:
+        return
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('rd_station_sync.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+@dataclass
+class PageResult:
+    """Resultado de uma página de oportunidades
+
+    `data` vem como None quando a API responde 304 (página inalterada);
+    `has_more` usa o sinal de paginação do servidor quando disponível.
+    """
+    data: Optional[Dict]
+    has_more: bool
+
+class ETagIndex:
+    """Índice de ETag/Last-Modified por (data, página) para GETs condicionais"""
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            self._entries = json.loads(path.read_text()) if path.exists() else {}
+        except (ValueError, OSError):
+            self._entries = {}
+
+    @staticmethod
+    def _key(date: datetime, page: int) -> str:
+        return f"{date.strftime('%Y-%m-%d')}_p{page}"
+
+    def get(self, date: datetime, page: int) -> Optional[Dict]:
+        with self._lock:
+            return self._entries.get(self._key(date, page))
+
+    def update(self, date: datetime, page: int, headers: Dict, has_more: bool):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return  # API não devolveu validadores; nada a indexar
+        # só atualiza em memória: gravar o índice inteiro no Drive a cada página
+        # serializaria as 16 threads atrás de uma escrita de centenas de ms
+        with self._lock:
+            self._entries[self._key(date, page)] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'has_more': has_more
+            }
+            self._dirty = True
+
+    def save(self):
+        """Persiste o índice uma única vez; a escrita acontece fora do lock"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = json.dumps(self._entries)
+            self._dirty = False
+        self.path.write_text(snapshot)
 
 class RDStationClient:
     """Cliente para interação com a API do RD Station"""
-    def __init__(self, config: APIConfig):
+    def __init__(self, config: APIConfig, etag_index: Optional[ETagIndex] = None):
         self.config = config
-        self._setup_logging()
+        self.logger = logging.getLogger(__name__)
         self.headers = {'accept': 'application/json'}
+        self.etag_index = etag_index
+        # Sessão reutiliza a conexão TCP/TLS entre as milhares de requisições paginadas
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=16, max_retries=0))
 
-    def _setup_logging(self):
-        """Configuração do sistema de logs"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('rd_station_sync.log'),
-                logging.StreamHandler()
-            ]
-        )
-        self.logger = logging.getLogger(__name__)
+    def close(self):
+        """Encerra a sessão HTTP e libera as conexões"""
+        self.session.close()
 
-    def fetch_deals(self, date: datetime, page: int = 1) -> Optional[Dict]:
-        """Busca oportunidades do RD Station para uma data e página específicas"""
+    def day_params(self, date: datetime) -> Dict:
+        """Monta os parâmetros fixos do dia uma única vez (só `page` varia entre as páginas)"""
         start_datetime = date.replace(hour=0, minute=0, second=1)
         end_datetime = date.replace(hour=23, minute=59, second=59)
-        
-        params = {
+        return {
             'token': self.config.token,
             'created_at_period': 'custom',  # Corrigido
             'start_date': start_datetime.strftime("%Y-%m-%dT%H:%M:%S"),
             'end_date': end_datetime.strftime("%Y-%m-%dT%H:%M:%S"),
-            'page': page,
             'per_page': self.config.per_page
         }
 
-        for attempt in range(self.config.retry_attempts):
+    def fetch_deals(self, date: datetime, day_params: Dict, page: int = 1) -> Optional[PageResult]:
+        """Busca oportunidades para uma data/página (None em caso de falha)"""
+        params = {**day_params, 'page': page}
+
+        # GET condicional: reaproveita o validador da execução anterior
+        conditional = {}
+        cached = self.etag_index.get(date, page) if self.etag_index is not None else None
+        if cached:
+            if cached.get('etag'):
+                conditional['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                conditional['If-Modified-Since'] = cached['last_modified']
+
+        attempt = 0
+        while True:
             try:
-                response = requests.get(
-                    self.config.base_url, 
+                response = self.session.get(
+                    self.config.base_url,
                     params=params,
-                    headers=self.headers,
-                    timeout=30
+                    headers=conditional or None,
+                    timeout=(5, 30)  # (conexão, leitura): um connect travado não segura o worker
                 )
+                if response.status_code == 304:
+                    # página inalterada: o arquivo salvo continua válido
+                    self.logger.info("🔁 %s (Página %d) inalterada (304) — download pulado", date.strftime('%d/%m/%Y'), page)
+                    return PageResult(None, cached.get('has_more', False))
+                if response.status_code == 429:
+                    # espera de rate limit não consome o orçamento de tentativas
+                    retry_after = _retry_after_seconds(response.headers.get('Retry-After'), self.config.retry_delay)
+                    self.logger.warning("🚦 Rate limit atingido. Aguardando %.0fs (Retry-After).", retry_after)
+                    sleep(retry_after)
+                    continue
                 response.raise_for_status()
-                
-                data = response.json()
 
-                qtd = len(data) if isinstance(data, list) else len(data.get('deals', []))
-                self.logger.info(f"✅ {date.strftime('%d/%m/%Y')} (Página {page}) - {qtd} registros")
-                return data
-                
-            except requests.exceptions.RequestException as e:
-                self.logger.error(f"❌ Tentativa {attempt + 1} falhou ({date.strftime('%d/%m/%Y')} p{page}): {e}")
-                if attempt < self.config.retry_attempts - 1:
-                    self.logger.info(f"⏳ Aguardando {self.config.retry_delay} segundos para nova tentativa...")
-                    sleep(self.config.retry_delay)
+                # orjson decodifica direto dos bytes, sem detecção de charset do requests
+                if orjson is not None:
+                    data = orjson.loads(response.content)
                 else:
-                    self.logger.error(f"❌ Falha após {self.config.retry_attempts} tentativas")
+                    data = response.json()
+
+                # prefere o sinal de paginação do servidor; a contagem fica como fallback
+                if isinstance(data, list):
+                    qtd = len(data)
+                    has_more = qtd == self.config.per_page
+                else:
+                    qtd = len(data.get('deals', ()))
+                    has_more = bool(data.get('has_more', qtd == self.config.per_page))
+                if self.etag_index is not None:
+                    self.etag_index.update(date, page, response.headers, has_more)
+                # formatação preguiçosa: nada de f-string no caminho quente
+                self.logger.info("✅ %s (Página %d) - %d registros", date.strftime('%d/%m/%Y'), page, qtd)
+                return PageResult(data, has_more)
+
+            except requests.exceptions.RequestException as e:
+                # 4xx (exceto o 429 tratado acima) é erro nosso: repetir não ajuda
+                status = getattr(e.response, 'status_code', None)
+                if status is not None and 400 <= status < 500:
+                    self.logger.error("❌ Erro %d em %s p%d — sem nova tentativa: %s", status, date.strftime('%d/%m/%Y'), page, e)
+                    return None
+
+                attempt += 1
+                self.logger.error("❌ Tentativa %d falhou (%s p%d): %s", attempt, date.strftime('%d/%m/%Y'), page, e)
+                if attempt >= self.config.retry_attempts:
+                    self.logger.error("❌ Falha após %d tentativas", self.config.retry_attempts)
                     return None
+                # backoff exponencial (teto de 60s) com jitter para não sincronizar as threads
+                delay = min(60, self.config.retry_delay * (2 ** (attempt - 1))) + random.uniform(0, 1.0)
+                self.logger.info("⏳ Aguardando %.1f segundos para nova tentativa...", delay)
+                sleep(delay)
 
 class DataExporter:
     """Gerencia a exportação dos dados para arquivos"""
-    def __init__(self, output_directory: str):
+    def __init__(self, output_directory: str, pretty: bool = False):
         self.output_dir = Path(output_directory)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._dir_str = str(self.output_dir)  # evita Path.__truediv__ a cada página
+        self.pretty = pretty  # indentação só para inspeção manual; arquivos de arquivo ficam compactos
+        # fila limitada dá backpressure se o mount do Drive atrasar as gravações
+        self._write_queue = queue.Queue(maxsize=64)
+        self._writer = threading.Thread(target=self._drain_writes, daemon=True)
+        self._writer.start()
+
+    def _drain_writes(self):
+        """Thread única de escrita: a rede não para enquanto o disco drena"""
+        while True:
+            filename, payload = self._write_queue.get()
+            try:
+                with open(filename, 'wb') as f:
+                    f.write(payload)
+                # sucesso só é anunciado depois que os bytes chegaram ao disco
+                logging.info("💾 Salvo: %s", filename)
+            except Exception:
+                # qualquer erro não pode matar a única thread de escrita, senão
+                # a fila enche, save_deals bloqueia e flush() trava para sempre
+                logging.exception("❌ Falha ao gravar %s", filename)
+            finally:
+                self._write_queue.task_done()
+
+    def flush(self):
+        """Aguarda todas as gravações pendentes terminarem"""
+        self._write_queue.join()
 
-    def save_deals(self, data: Dict, date: datetime, page: int) -> Path:
-        """Salva as oportunidades em arquivo JSON"""
-        filename = self.output_dir / f"oportunidades_{date.strftime('%Y-%m-%d')}_p{page}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+    @staticmethod
+    def day_stem(date: datetime) -> str:
+        """Prefixo de arquivo do dia, calculado uma única vez por dia"""
+        return f"oportunidades_{date.strftime('%Y-%m-%d')}"
+
+    def save_deals(self, data: Dict, day_stem: str, page: int) -> str:
+        """Serializa as oportunidades e agenda a gravação na thread de escrita"""
+        filename = f"{self._dir_str}{os.sep}{day_stem}_p{page}.json"
+        if orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if self.pretty else 0)
+            payload = orjson.dumps(data, option=option)
+        elif self.pretty:
+            payload = json.dumps(data, ensure_ascii=False, indent=4).encode('utf-8')
+        else:
+            payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._write_queue.put((filename, payload))
         return filename
 
+def process_day(client: RDStationClient, exporter: DataExporter, date: datetime):
+    """Executa o loop de paginação de um dia inteiro (uma thread por dia)"""
+    day_params = client.day_params(date)
+    day_stem = exporter.day_stem(date)
+    page = 1
+    while True:
+        result = client.fetch_deals(date, day_params, page)
+        if result is None:
+            break
+
+        if result.data is not None:
+            exporter.save_deals(result.data, day_stem, page)
+
+        # Paginação segura — para quando o servidor sinaliza o fim
+        if not result.has_more:
+            logging.info("📋 Todas as páginas de %s processadas", date.strftime('%d/%m/%Y'))
+            break
+
+        page += 1
+
 def main():
+    configure_logging()
+
     # Configuração
     config = APIConfig(
         base_url='https://crm.rdstation.com/api/v1/deals',
@@ -98,32 +291,24 @@ def main():
         r'pasta_de_destino\Nome_da_pasta'
     )
     
-    client = RDStationClient(config)
     exporter = DataExporter(output_dir)
+    etag_index = ETagIndex(exporter.output_dir / 'etag_index.json')
+    client = RDStationClient(config, etag_index)
     
     start_date = datetime(2024, 7, 31)
     end_date = datetime.now()
 
-    current_date = start_date
-    while current_date <= end_date:
-        page = 1
-        while True:
-            data = client.fetch_deals(current_date, page)
-            if not data:
-                break
-            
-            file_path = exporter.save_deals(data, current_date, page)
-            logging.info(f"💾 Salvo: {file_path}")
-
-            # Paginação segura — para quando não houver mais registros
-            registros = data if isinstance(data, list) else data.get('deals', [])
-            if not registros or len(registros) < config.per_page:
-                logging.info(f"📋 Todas as páginas de {current_date.strftime('%d/%m/%Y')} processadas")
-                break
-
-            page += 1
-        
-        current_date += timedelta(days=1)
+    dates = [start_date + timedelta(days=i)
+             for i in range((end_date - start_date).days + 1)]
+
+    # I/O puro: a Session é thread-safe para .get e cada dia escreve em arquivos próprios
+    try:
+        with ThreadPoolExecutor(max_workers=config.max_workers) as executor:
+            list(executor.map(partial(process_day, client, exporter), dates))
+    finally:
+        client.close()
+        exporter.flush()
+        etag_index.save()
 
 if __name__ == "__main__":
     try:
@@ -1,11 +1,33 @@
-import requests
+import asyncio
+import httpx
+import importlib.util
 import json
 import logging
-from datetime import datetime, timedelta
+import random
+import time
+
+try:
+    import orjson
+except ImportError:  # fallback para a stdlib
+    orjson = None
+
+try:
+    import zstandard as zstd
+except ImportError:  # sem compressão, grava JSONL puro
+    zstd = None
+
+try:
+    import ijson
+except ImportError:  # sem streaming, decodifica a resposta inteira de uma vez
+    ijson = None
+
+# erros de transporte e de parse que o laço de retry de fetch_deals trata
+_RETRYABLE_ERRORS = (httpx.HTTPError,) if ijson is None else (httpx.HTTPError, ijson.JSONError)
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 from typing import Dict, Optional
 from dataclasses import dataclass
-from time import sleep
 
 @dataclass
 class APIConfig:
@@ -14,112 +36,299 @@ class APIConfig:
     per_page: int = 200
     retry_attempts: int = 3
     retry_delay: int = 5
+    max_concurrency: int = 16
+
+def _retry_after_seconds(value: Optional[str], default: float) -> float:
+    """Interpreta Retry-After tanto em segundos quanto em HTTP-date (RFC 7231)."""
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        wait = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return default
+    return max(wait, 0.0)
+
+def configure_logging():
+    """Configura o logging uma única vez por processo (sem handlers duplicados)."""
+    if logging.getLogger().handlers:
+        return
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('rd_station_sync.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+class RateLimiter:
+    """Token bucket realimentado pelos cabeçalhos X-RateLimit-* da API."""
+
+    def __init__(self, rate: float = 10.0, burst: int = 20):
+        self.rate = rate  # tokens por segundo
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Aguarda até haver um token disponível antes de liberar a requisição."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update(self, headers):
+        """Recalibra o ritmo com o saldo/reset informados pela própria API."""
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = int(remaining)
+            reset = float(reset)
+        except ValueError:
+            return
+        if reset > 1e9:  # epoch em vez de segundos restantes
+            reset -= time.time()
+        window = max(reset, 1.0)
+        self.rate = max(remaining / window, 0.1)
+        self.tokens = min(self.tokens, float(remaining))
+
+def _dump_line(deal: Dict) -> bytes:
+    """Serializa uma oportunidade como uma linha JSONL."""
+    if orjson is not None:
+        return orjson.dumps(deal, option=orjson.OPT_NON_STR_KEYS) + b'\n'
+    return json.dumps(deal, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+class _AsyncResponseReader:
+    """Adapta o corpo em streaming do httpx para a interface de arquivo async do ijson."""
+
+    def __init__(self, response: httpx.Response):
+        self._chunks = response.aiter_bytes()
+
+    async def read(self, n: int = -1) -> bytes:
+        if n == 0:
+            # o ijson sonda a fonte com read(0) antes do parse; devolver um
+            # chunk aqui descartaria o começo do corpo
+            return b''
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b''
 
 class RDStationClient:
-    def __init__(self, config: APIConfig):
+    def __init__(self, config: APIConfig, session: httpx.AsyncClient,
+                 limiter: Optional[RateLimiter] = None):
         self.config = config
-        self._setup_logging()
-        self.headers = {'accept': 'application/json'}
-
-    def _setup_logging(self):
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('rd_station_sync.log'),
-                logging.StreamHandler()
-            ]
-        )
+        self.session = session
+        self.limiter = limiter
         self.logger = logging.getLogger(__name__)
 
-    def fetch_deals(self, date: datetime, page: int = 1) -> Optional[Dict]:
+    def day_params(self, date: datetime) -> Dict:
+        """Monta os parâmetros fixos do dia uma única vez (só `page` varia entre as páginas)."""
         start_datetime = date.replace(hour=0, minute=0, second=1)
         end_datetime = date.replace(hour=23, minute=59, second=59)
-
-        params = {
+        return {
             'token': self.config.token,
-            'created_at_period': True,
+            'created_at_period': 'true',
             'start_date': start_datetime.strftime("%Y-%m-%dT%H:%M:%S"),
             'end_date': end_datetime.strftime("%Y-%m-%dT%H:%M:%S"),
-            'page': page,
             'per_page': self.config.per_page
         }
 
-        for attempt in range(self.config.retry_attempts):
+    def _throttle(self, response: httpx.Response) -> Optional[float]:
+        """Atualiza o limiter e devolve o tempo de espera quando a API responde 429."""
+        if self.limiter is not None:
+            self.limiter.update(response.headers)
+        if response.status_code == 429:
+            return _retry_after_seconds(response.headers.get('Retry-After'), self.config.retry_delay)
+        return None
+
+    async def fetch_deals(self, date: datetime, day_params: Dict, page: int = 1) -> Optional[list]:
+        """Busca uma página e devolve as oportunidades já como linhas JSONL (None em caso de falha)."""
+        params = {**day_params, 'page': page}
+
+        attempt = 0
+        while True:
             try:
-                response = requests.get(
-                    self.config.base_url,
-                    params=params,
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                self.logger.info(f"✅ Dados de {date.strftime('%d/%m/%Y')} (Página {page}) obtidos com sucesso.")
-                return response.json()
-
-            except requests.exceptions.RequestException as e:
-                self.logger.warning(f"❌ Tentativa {attempt + 1} falhou para {date.strftime('%d/%m/%Y')} (Página {page}): {str(e)}")
-                if attempt < self.config.retry_attempts - 1:
-                    self.logger.info(f"⏳ Aguardando {self.config.retry_delay}s para nova tentativa...")
-                    sleep(self.config.retry_delay)
+                if self.limiter is not None:
+                    await self.limiter.acquire()
+                if ijson is not None:
+                    # parse incremental: cada oportunidade vira bytes na hora e o
+                    # dicionário é liberado em seguida — só uma existe por vez;
+                    # o corpo bruto e a página decodificada nunca se materializam
+                    async with self.session.stream('GET', self.config.base_url, params=params) as response:
+                        retry_after = self._throttle(response)
+                        if retry_after is None:
+                            response.raise_for_status()
+                            lines = [_dump_line(deal) async for deal
+                                     in ijson.items(_AsyncResponseReader(response), 'deals.item')]
                 else:
+                    response = await self.session.get(self.config.base_url, params=params)
+                    retry_after = self._throttle(response)
+                    if retry_after is None:
+                        response.raise_for_status()
+                        raw = response.content
+                        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+                        lines = [_dump_line(deal) for deal in data.get('deals', [])]
+                if retry_after is not None:
+                    # espera de rate limit não consome o orçamento de tentativas
+                    self.logger.warning("🚦 Rate limit atingido. Aguardando %.0fs (Retry-After).", retry_after)
+                    await asyncio.sleep(retry_after)
+                    continue
+                # formatação preguiçosa: nada de f-string no caminho quente
+                self.logger.info("✅ Dados de %s (Página %d) obtidos com sucesso.", date.strftime('%d/%m/%Y'), page)
+                return lines
+
+            except _RETRYABLE_ERRORS as e:
+                attempt += 1
+                self.logger.warning("❌ Tentativa %d falhou para %s (Página %d): %s", attempt, date.strftime('%d/%m/%Y'), page, e)
+                if attempt >= self.config.retry_attempts:
                     self.logger.error("❌ Falha definitiva após várias tentativas.")
                     return None
+                # backoff exponencial (teto de 60s) com jitter para não sincronizar as corrotinas
+                delay = min(60, self.config.retry_delay * (2 ** (attempt - 1))) + random.uniform(0, 1.0)
+                self.logger.info("⏳ Aguardando %.1fs para nova tentativa...", delay)
+                await asyncio.sleep(delay)
 
 class DataExporter:
     def __init__(self, output_directory: str):
         self.output_dir = Path(output_directory)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.output_dir / '.state.json'
+
+    def completed_days(self) -> set:
+        """Dias já baixados por inteiro em execuções anteriores."""
+        if not self.state_path.exists():
+            return set()
+        try:
+            return set(json.loads(self.state_path.read_text()).get('completed', []))
+        except (ValueError, OSError):
+            return set()
+
+    def mark_day_completed(self, date: datetime):
+        completed = self.completed_days()
+        completed.add(date.strftime('%Y-%m-%d'))
+        self.state_path.write_text(json.dumps({'completed': sorted(completed)}))
+
+    def day_path(self, date: datetime) -> Path:
+        suffix = '.jsonl.zst' if zstd is not None else '.jsonl'
+        return self.output_dir / f"oportunidades_{date.strftime('%Y-%m-%d')}{suffix}"
+
+    def open_day(self, date: datetime):
+        """Abre o arquivo JSONL do dia (uma oportunidade por linha).
+
+        Sobrescreve o que existir: um dia fora de `.state.json` é parcial
+        e recomeça do zero, evitando registros duplicados.
+        """
+        f = open(self.day_path(date), 'wb')
+        if zstd is not None:
+            # um compressor por arquivo: ZstdCompressor não é thread-safe e os
+            # dias concorrentes escrevem de threads distintas do executor;
+            # nível 3 + threads=-1 mantém o custo desprezível frente ao Drive
+            cctx = zstd.ZstdCompressor(level=3, threads=-1)
+            return cctx.stream_writer(f, closefd=True)
+        return f
+
+    def save_deals(self, f, lines: list) -> int:
+        # uma única write: o ZstdCompressionWriter não implementa writelines
+        f.write(b''.join(lines))
+        return len(lines)
 
-    def save_deals(self, data: Dict, date: datetime, page: int) -> Optional[Path]:
-        deals = data.get("deals", [])
-        if not deals:
-            return None  # não salva se estiver vazio
+async def process_day(client: RDStationClient, exporter: DataExporter,
+                      semaphore: asyncio.Semaphore, date: datetime):
+    """Busca e salva todas as páginas de um dia (paginação sequencial dentro da corrotina)."""
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        day_params = client.day_params(date)
+        page = 1
+        day_file = None  # aberto só na primeira página com dados
+        finished = False  # só marca o dia no estado se a paginação terminou sem falha
+        try:
+            while True:
+                lines = await client.fetch_deals(date, day_params, page)
+                if lines is None:
+                    break
+
+                if not lines:
+                    logging.info("⚠️ Página %d de %s estava vazia. Encerrando buscas para este dia.", page, date.strftime('%d/%m/%Y'))
+                    finished = True
+                    break  # se os dados estão vazios, não precisa ir pra próxima página
+
+                if day_file is None:
+                    day_file = exporter.open_day(date)
+
+                # Escrita em disco fora do event loop
+                await loop.run_in_executor(None, exporter.save_deals, day_file, lines)
+                logging.info("✅ Página %d de %s salva em %s", page, date.strftime('%d/%m/%Y'), exporter.day_path(date))
+
+                # Critério de parada mais seguro: menos que `per_page` registros
+                if len(lines) < client.config.per_page:
+                    logging.info("📋 Fim das páginas para o dia %s", date.strftime('%d/%m/%Y'))
+                    finished = True
+                    break
 
-        filename = self.output_dir / f"oportunidades_{date.strftime('%Y-%m-%d')}_p{page}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        return filename
+                page += 1
+        finally:
+            if day_file is not None:
+                await loop.run_in_executor(None, day_file.close)
+        # o dia corrente nunca entra no estado: registros ainda podem chegar
+        # depois desta execução e precisam ser rebuscados na próxima
+        if finished and date.date() < datetime.now().date():
+            exporter.mark_day_completed(date)
+
+async def main():
+    configure_logging()
 
-def main():
     config = APIConfig(
         base_url='https://crm.rdstation.com/api/v1/deals',
         token='token'
     )
 
     output_dir = Path(r'Pasta_de_destino\nome_da_pasta_destino')
-    
-    client = RDStationClient(config)
     exporter = DataExporter(output_dir)
 
     start_date = datetime(2024, 7, 30)
     end_date = datetime.now()
-    
-    current_date = start_date
-    while current_date <= end_date:
-        page = 1
-        while True:
-            data = client.fetch_deals(current_date, page)
-            if not data:
-                break
-
-            file_path = exporter.save_deals(data, current_date, page)
-            if file_path:
-                logging.info(f"✅ Página {page} de {current_date.strftime('%d/%m/%Y')} salva em {file_path}")
-            else:
-                logging.info(f"⚠️ Página {page} de {current_date.strftime('%d/%m/%Y')} estava vazia. Encerrando buscas para este dia.")
-                break  # se os dados estão vazios, não precisa ir pra próxima página
+    dates = [start_date + timedelta(days=i)
+             for i in range((end_date - start_date).days + 1)]
 
-            # Critério de parada mais seguro: menos que `per_page` registros
-            if len(data.get("deals", [])) < config.per_page:
-                logging.info(f"📋 Fim das páginas para o dia {current_date.strftime('%d/%m/%Y')}")
-                break
+    # Retomada incremental: pula dias já concluídos, mas sempre rebusca o dia
+    # corrente (registros ainda podem estar chegando).
+    completed = exporter.completed_days()
+    today = end_date.strftime('%Y-%m-%d')
+    dates = [d for d in dates
+             if d.strftime('%Y-%m-%d') not in completed or d.strftime('%Y-%m-%d') == today]
+    if completed:
+        logging.info("⏭️ %d dia(s) já baixado(s) serão pulados.", len(completed))
 
-            page += 1
+    semaphore = asyncio.Semaphore(config.max_concurrency)
+    limiter = RateLimiter()
 
-        current_date += timedelta(days=1)
+    # HTTP/2 multiplexa as requisições concorrentes em poucas conexões TLS,
+    # mas exige o extra httpx[http2]; sem o h2 instalado, segue em HTTP/1.1
+    http2 = importlib.util.find_spec('h2') is not None
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    # connect/read separados: um handshake travado não segura a corrotina até o timeout total
+    timeout = httpx.Timeout(60.0, connect=5.0, read=30.0)
+    async with httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout,
+                                 headers={'accept': 'application/json'}) as session:
+        client = RDStationClient(config, session, limiter)
+        await asyncio.gather(*(process_day(client, exporter, semaphore, date)
+                               for date in dates))
 
 if __name__ == "__main__":
     try:
-        main()
+        asyncio.run(main())
     except Exception as e:
         logging.error(f"❌ Erro inesperado: {str(e)}")